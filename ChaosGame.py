@@ -1,3 +1,129 @@
+import numpy as np
+
+try:
+    from numba import config, get_num_threads, njit, prange, set_num_threads
+
+    _HAVE_NUMBA = True
+    _MAX_THREADS = config.NUMBA_NUM_THREADS
+except ImportError:
+    # without Numba the kernels below run from the chaos_game_impl Cython extension if it has been built, otherwise
+    # as plain python
+    _HAVE_NUMBA = False
+    _MAX_THREADS = 1
+    prange = range
+
+    def get_num_threads():
+        return 1
+
+    def set_num_threads(n):
+        pass
+
+    def njit(*args, **kwargs):
+        return lambda kernel: kernel
+
+
+@njit(cache=True, parallel=True, nogil=True)
+def _r0_play_nb(vertices, ratio, draws, shape, starts, burn_in, xs, ys):
+    """
+    Compiled loop of ChaosGame._r0_play, writes each new point into xs and ys. Vertices are picked using the uniform
+    draws in [0, 1), one per round. The rounds are split evenly into one chunk per start point, played in parallel.
+    """
+    chunks = starts.shape[0]
+
+    for c in prange(chunks):
+        x, y = starts[c, 0], starts[c, 1]
+
+        lo, hi = c * xs.size // chunks, (c + 1) * xs.size // chunks
+
+        for k in range(lo - burn_in, hi):
+
+            draw = draws[k + (c + 1) * burn_in]
+
+            random_index = int(draw * shape)
+
+            x = (x + vertices[random_index, 0]) * ratio
+            y = (y + vertices[random_index, 1]) * ratio
+
+            if k >= lo:
+                xs[k] = x
+                ys[k] = y
+
+
+@njit(cache=True, parallel=True, nogil=True)
+def _r2_play_nb(vertices, ratio, draws, shape, neighbours, starts, burn_in, xs, ys):
+    """
+    Compiled loop of ChaosGame._r2_play, writes each new point into xs and ys. Vertices are picked using the uniform
+    draws in [0, 1), one per round, excluding the entry of neighbours for the previous vertex. ChaosGame._r1_play
+    runs it with each vertex as its own neighbour. The rounds are split evenly into one chunk per start point, played
+    in parallel.
+    """
+    chunks = starts.shape[0]
+
+    for c in prange(chunks):
+        x, y = starts[c, 0], starts[c, 1]
+
+        # no vertex is excluded until one has been chosen
+        forbidden = shape
+
+        lo, hi = c * xs.size // chunks, (c + 1) * xs.size // chunks
+
+        for k in range(lo - burn_in, hi):
+
+            draw = draws[k + (c + 1) * burn_in]
+
+            # draw from the vertices that remain and step over the excluded one
+            random_index = int(draw * (shape - (forbidden < shape)))
+            random_index += random_index >= forbidden
+
+            x = (x + vertices[random_index, 0]) * ratio
+            y = (y + vertices[random_index, 1]) * ratio
+            forbidden = neighbours[random_index]
+
+            if k >= lo:
+                xs[k] = x
+                ys[k] = y
+
+
+@njit(cache=True, parallel=True, nogil=True)
+def _r4_play_nb(vertices, ratio, draws, shape, allowed, starts, burn_in, xs, ys):
+    """
+    Compiled loop of ChaosGame._r4_play, writes each new point into xs and ys. Vertices are picked using the uniform
+    draws in [0, 1), one per round, from the row of allowed for the previous vertex whenever the two previous
+    vertices match. The rounds are split evenly into one chunk per start point, played in parallel.
+    """
+    chunks = starts.shape[0]
+
+    for c in prange(chunks):
+        x, y = starts[c, 0], starts[c, 1]
+        prev_0, prev_1 = -2, -1
+
+        lo, hi = c * xs.size // chunks, (c + 1) * xs.size // chunks
+
+        for k in range(lo - burn_in, hi):
+
+            draw = draws[k + (c + 1) * burn_in]
+
+            if prev_0 == prev_1:
+                random_index = allowed[prev_1, int(draw * allowed.shape[1])]
+            else:
+                random_index = int(draw * shape)
+
+            x = (x + vertices[random_index, 0]) * ratio
+            y = (y + vertices[random_index, 1]) * ratio
+            prev_0, prev_1 = prev_1, random_index
+
+            if k >= lo:
+                xs[k] = x
+                ys[k] = y
+
+
+if not _HAVE_NUMBA:
+    try:
+        from chaos_game_impl import r0_play as _r0_play_nb, r2_play as _r2_play_nb, r4_play as _r4_play_nb
+    except ImportError:
+        pass
+
+
 class ChaosGame:
     """
     The Chaos Game as termed by Michael F. Barnsley is a game in which the starting position is chosen at random
@@ -24,7 +150,8 @@ class ChaosGame:
         r4 - prevent chosen vertex being neighbours with the previous if the previous two vertices match.
 
     The ratio of the distance to travel before marking a point can be controlled with the ratio parameter. This
-    is defaulted to 1/2.
+    is defaulted to 1/2. The random number generator can be seeded with the seed parameter so that a game can be
+    replayed exactly.
 
     There are other restrictions that can be put in place to create differing results. In addition, other ratios
     other than the midpoint can be used to find new points. More information can be found at...
@@ -32,18 +159,35 @@ class ChaosGame:
     https://en.wikipedia.org/wiki/Chaos_game
     """
 
-    def __init__(self, shape=3, rule="r0", ratio=1 / 2, *args, **kwargs):
+    def __init__(self, shape=3, rule="r0", ratio=1 / 2, seed=None, *args, **kwargs):
+
+        # r1 to r3 exclude a vertex each round and r4 its neighbours, which leaves nothing to pick from a single
+        # vertex and the kernels would read past the vertices, or r4's empty table, unchecked
+        min_shape = 2 if rule in ("r1", "r2", "r3", "r4") else 1
+        if shape < min_shape:
+            raise ValueError("rule {} needs a polygon of at least {} vertices, got {}".format(rule, min_shape, shape))
 
-        self.random = __import__("random")
-        self.math = __import__("math")
+        self.rng = np.random.default_rng(seed)
 
         self.rule = rule
         self.ratio = ratio
         self.vertices = self._generate_polygon(shape)
 
         self.shape = shape
+
+        dtype = np.min_scalar_type(shape)
+
+        # the clockwise and anti-clockwise neighbour of each vertex
+        self._cw = np.array([(u + 1) % shape for u in range(shape)], dtype=dtype)
+        self._ccw = np.array([(u - 1) % shape for u in range(shape)], dtype=dtype)
+
+        # the vertices r4 may pick after picking the same vertex twice, i.e. all bar its neighbours
+        self._r4_tbl = np.array([[v for v in range(shape) if v not in (self._ccw[u], self._cw[u])]
+                                 for u in range(shape)], dtype=dtype)
+
         self.start = self._random_start_point()
-        self.points = []
+        self.xs = np.empty(0, dtype=np.float32)
+        self.ys = np.empty(0, dtype=np.float32)
 
     def _generate_polygon(self, no_of_vertices):
         """
@@ -54,32 +198,10 @@ class ChaosGame:
         
         :return vertices: The vertices of the boundary.
         """
-        radians = 2 * self.math.pi / no_of_vertices
-
-        x0, y0 = 0, 1
-        vertices = [(x0, y0)]
-
-        for vertex in range(1, no_of_vertices):
-            x = x0 * self.math.cos(vertex * radians) - y0 * self.math.sin(vertex * radians)
-            y = y0 * self.math.cos(vertex * radians) - x0 * self.math.sin(vertex * radians)
-
-            vertices.append((round(x, 2), round(y, 2)))
-
-        return vertices
-
-    def _get_mid_point(self, point_a, point_b):
-        """
-        Method to get the midpoint between two points.
-
-        :param point_a: The first point x1, y1.
-        :param point_b: The second point x2, y2.
-
-        :return: the midpoint xm, ym.
-        """
-        x_mid = (point_a[0] + point_b[0]) * self.ratio
-        y_mid = (point_a[1] + point_b[1]) * self.ratio
+        theta = 2 * np.pi * np.arange(no_of_vertices) / no_of_vertices
 
-        return x_mid, y_mid
+        # (0, 1) rotated anti-clockwise by theta
+        return np.column_stack([-np.sin(theta), np.cos(theta)]).astype(np.float32)
 
     def _random_start_point(self):
         """
@@ -92,124 +214,126 @@ class ChaosGame:
 
         :return: x, y coordinates.
         """
-        x = y = self.random.random() * (0.5 - -0.5) + -0.5
+        x = y = self.rng.random() * (0.5 - -0.5) + -0.5
 
         return x, y
 
-    def _r0_play(self, iterations):
+    def _r0_play(self, draws, starts, burn_in):
         """
         Will pick a random vertex of the triangle and draw the midpoint between the current point and the vertex.
-        Midpoints are added to the list of points.
+        Midpoints are written into the xs and ys arrays.
 
-        :param iterations: The number of rounds to play the game.
+        :param draws: The uniform random numbers used to pick a vertex each round.
+        :param starts: The start point of each chunk of the game.
+        :param burn_in: The number of rounds each chunk plays before its points are recorded.
         """
-        new_point = self.start
-
-        for _ in range(iterations):
-            random_index = self.random.randint(0, self.shape - 1)
-            bound_point = self.vertices[random_index]
+        _r0_play_nb(self.vertices, np.float32(self.ratio), draws, self.shape,
+                    starts, burn_in, self.xs, self.ys)
 
-            new_point = self._get_mid_point(new_point, bound_point)
-            self.points.append(new_point)
-
-    def _r1_play(self, iterations):
+    def _r1_play(self, draws, starts, burn_in):
         """
         Will pick a random vertex and draw the midpoint between the current point and the vertex.
         The additional constraint is added as such that the next vertex picked may not be the same as the previous.
-        Midpoints are added to the list of points.
+        Midpoints are written into the xs and ys arrays.
 
-        :param iterations: The number of rounds to play the game.
+        :param draws: The uniform random numbers used to pick a vertex each round.
+        :param starts: The start point of each chunk of the game.
+        :param burn_in: The number of rounds each chunk plays before its points are recorded.
         """
-        new_point = self.start
-        random_index, prev_index = self.random.randint(0, self.shape - 1), -2
-
-        for _ in range(iterations):
-
-            random_index = self.random.randint(0, self.shape - 1)
-            while random_index == prev_index:
-                random_index = self.random.randint(0, self.shape - 1)
-
-            bound_point = self.vertices[random_index]
+        # excluding the previous vertex itself is r2 with each vertex as its own neighbour
+        neighbours = np.arange(self.shape, dtype=self._cw.dtype)
+        _r2_play_nb(self.vertices, np.float32(self.ratio), draws, self.shape, neighbours,
+                    starts, burn_in, self.xs, self.ys)
 
-            new_point = self._get_mid_point(new_point, bound_point)
-            prev_index = random_index
-
-            self.points.append(new_point)
-
-    def _r2_play(self, iterations, clockwise=False):
+    def _r2_play(self, draws, starts, burn_in, clockwise=False):
         """
         Will pick a random vertex and draw the midpoint between the current point and the vertex.
         The additional constraint is added as such that the next vertex picked may not one step away from the previous.
-        Midpoints are added to the list of points.
+        Midpoints are written into the xs and ys arrays.
 
-        :param iterations: The number of rounds to play the game.
+        :param draws: The uniform random numbers used to pick a vertex each round.
+        :param starts: The start point of each chunk of the game.
+        :param burn_in: The number of rounds each chunk plays before its points are recorded.
         :param clockwise: Whether the clockwise neighbor is to be prevented or not.
         """
-        new_point = self.start
-        random_index, prev_index = self.random.randint(0, self.shape - 1), -2
-
-        for _ in range(iterations):
-
-            random_index = self.random.randint(0, self.shape - 1)
-            if clockwise:
-                while random_index == (prev_index + 1) % self.shape:
-                    random_index = self.random.randint(0, self.shape - 1)
-            else:
-                while random_index == (prev_index - 1) % self.shape:
-                    random_index = self.random.randint(0, self.shape - 1)
+        neighbours = self._cw if clockwise else self._ccw
+        _r2_play_nb(self.vertices, np.float32(self.ratio), draws, self.shape, neighbours,
+                    starts, burn_in, self.xs, self.ys)
 
-            bound_point = self.vertices[random_index]
-
-            new_point = self._get_mid_point(new_point, bound_point)
-            prev_index = random_index
-
-            self.points.append(new_point)
-
-    def _r4_play(self, iterations):
+    def _r4_play(self, draws, starts, burn_in):
         """
         Will pick a random vertex and draw the midpoint between the current point and the vertex.
         The additional constraint is added as such that the next vertex picked may not one step away from the previous
-        if the two previous vertices match. Midpoints are added to the list of points.
+        if the two previous vertices match. Midpoints are written into the xs and ys arrays.
 
-        :param iterations: The number of rounds to play the game.
+        :param draws: The uniform random numbers used to pick a vertex each round.
+        :param starts: The start point of each chunk of the game.
+        :param burn_in: The number of rounds each chunk plays before its points are recorded.
         """
-        new_point = self.start
-        prev = [-2, -1]
-        for _ in range(iterations):
-            random_index = self.random.randint(0, self.shape - 1)
-
-            if prev[-1] == prev[-2]:
-                while random_index == (prev[-1] - 1) % self.shape or random_index == (prev[-1] + 1) % self.shape:
-                    random_index = self.random.randint(0, self.shape - 1)
+        _r4_play_nb(self.vertices, np.float32(self.ratio), draws, self.shape, self._r4_tbl,
+                    starts, burn_in, self.xs, self.ys)
 
-            bound_point = self.vertices[random_index]
-
-            new_point = self._get_mid_point(new_point, bound_point)
-            prev[-2], prev[-1] = prev[-1], random_index
-
-            self.points.append(new_point)
-
-    def play(self, iterations=1000):
+    def play(self, iterations=1000, threads=None, burn_in=100, chunks=16):
         """
         Method to begin playing the Chaos Game. The game will be played by different rules based on the starting
         geometry of the boundary.
 
+        The rounds are split evenly into chunks, each playing its share from its own start point with its own
+        independent stream of random numbers, and the chunks are shared out between the threads. The points only
+        form a cloud, so the picture is the same as that of a single game. The split does not depend on the number
+        of threads, so a seeded game is replayed exactly on any machine. The first points of each share lie off the
+        attractor, so those from the first burn_in rounds are thrown away.
+
         :param iterations: The number of rounds to play the game.
+        :param threads: The number of threads to play on, defaults to the number Numba is set to use and is capped
+        at the number it can start. Without Numba the chunks are played one after the other.
+        :param burn_in: The number of rounds each chunk plays before its points are recorded.
+        :param chunks: The number of chunks the rounds are split into.
         """
-        if self.rule == "r0":
-            self._r0_play(iterations)
+        if burn_in < 0:
+            raise ValueError("burn_in must not be negative, got {}".format(burn_in))
+
+        chunks = max(1, min(iterations, chunks))
+
+        starts = np.empty((chunks, 2), dtype=np.float32)
+        starts[0] = self.start
+        for c in range(1, chunks):
+            starts[c] = self._random_start_point()
+
+        # each chunk plays burn_in rounds before its first recorded one, giving it time to settle onto the attractor.
+        # It fills its share of the draws, burn in included, from a stream spawned off the game's generator
+        draws = np.empty(iterations + chunks * burn_in, dtype=np.float32)
+        for c, rng in enumerate(self.rng.spawn(chunks)):
+            lo, hi = c * iterations // chunks + c * burn_in, (c + 1) * iterations // chunks + (c + 1) * burn_in
+            rng.random(out=draws[lo:hi], dtype=np.float32)
+
+        # every rule writes its points into place rather than appending them, single precision is plenty for
+        # plotting and keeps twice as many points in cache. The coordinates are kept apart so they can be handed
+        # straight to matplotlib.
+        self.xs = np.empty(iterations, dtype=np.float32)
+        self.ys = np.empty(iterations, dtype=np.float32)
+
+        previous_threads = get_num_threads()
+        if threads is not None:
+            set_num_threads(max(1, min(threads, _MAX_THREADS)))
+
+        try:
+            if self.rule == "r0":
+                self._r0_play(draws, starts, burn_in)
 
-        elif self.rule == "r1":
-            self._r1_play(iterations)
+            elif self.rule == "r1":
+                self._r1_play(draws, starts, burn_in)
 
-        elif self.rule == "r2":
-            self._r2_play(iterations)
+            elif self.rule == "r2":
+                self._r2_play(draws, starts, burn_in)
 
-        elif self.rule == "r3":
-            self._r2_play(iterations, clockwise=True)
+            elif self.rule == "r3":
+                self._r2_play(draws, starts, burn_in, clockwise=True)
 
-        elif self.rule == "r4":
-            self._r4_play(iterations)
+            elif self.rule == "r4":
+                self._r4_play(draws, starts, burn_in)
+        finally:
+            set_num_threads(previous_threads)
 
 
 if __name__ == "__main__":
@@ -232,10 +356,7 @@ if __name__ == "__main__":
     #     ax.axis("off")
     #     ax.grid(b=None)
     #
-    #     ax.scatter([x for x, _ in game.points],
-    #                [y for _, y in game.points],
-    #                0.01,
-    #                color="black")
+    #     ax.scatter(game.xs, game.ys, 0.01, color="black")
     #
     #
     # fig, ax = plt.subplots(figsize=(5, 5))
@@ -248,10 +369,7 @@ if __name__ == "__main__":
     game = ChaosGame(shape=5, rule="r4", ratio=.5)
     game.play(100_000)
 
-    plt.scatter([x for x, _ in game.points],
-                [y for _, y in game.points],
-                0.01,
-                color="black")
+    plt.scatter(game.xs, game.ys, 0.01, color="black")
     plt.plot([x for x, _ in game.vertices] + [game.vertices[0][0]],
              [y for _, y in game.vertices] + [game.vertices[0][1]], color="red")
     plt.scatter(game.start[0], game.start[1], 24, color="green")
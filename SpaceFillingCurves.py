@@ -1,3 +1,82 @@
+import functools
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+
+    _HAVE_NUMBA = True
+except ImportError:
+    # without Numba the kernels below run from the chaos_game_impl Cython extension if it has been built, otherwise
+    # as plain python
+    _HAVE_NUMBA = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        return lambda kernel: kernel
+
+
+@njit(cache=True)
+def _d2xy(index, n):
+    """
+    Function mapping a 1 dimensional index of a Pseudo Hilbert Curve to its 2 dimensional coordinates. Works up from
+    the smallest sub-planes, reading two bits of the index per level.
+
+    :param index: The indexed position in 1 dimensional space ranging from 0 to n^2
+    :param n: The width of the plane the curve occupies, a power of 2.
+
+    :return: a tuple containing the x, y coordinates in 2 dimensional space.
+    """
+    x = y = 0
+
+    s = 1
+    while s < n:
+        rx = 1 & (index >> 1)
+        ry = 1 & (index ^ rx)
+
+        # the first quadrant is transposed and the last flipped before the curve is copied into them
+        if ry == 0:
+            if rx == 1:
+                x, y = s - 1 - x, s - 1 - y
+            x, y = y, x
+
+        x += s * rx
+        y += s * ry
+        index >>= 2
+        s <<= 1
+
+    return x, y
+
+
+@njit(cache=True, parallel=True)
+def _build_hilbert(n, out):
+    """
+    Compiled loop filling out with the coordinates of every index of a Pseudo Hilbert Curve. Each index is mapped
+    independently of the others, so they are shared out between threads.
+    """
+    for i in prange(n * n):
+        out[i, 0], out[i, 1] = _d2xy(i, n)
+
+
+@functools.lru_cache(maxsize=8)
+def _hilbert_points(order):
+    """
+    Function for generating the coordinates of a Pseudo Hilbert Curve. The curve only depends on its order so it is
+    cached, the returned array is read only as it is shared between callers.
+
+    :param order: The order of the curve, the plane it occupies is N = 2^order wide.
+
+    :return: an array of shape (N^2, 2) containing the x, y coordinates in 2 dimensional space.
+    """
+    n = 2**order
+
+    points = np.empty((n * n, 2), dtype=np.int32)
+    _build_hilbert(n, points)
+    points.flags.writeable = False
+
+    return points
+
+
 class HilbertCurve:
     """
     The hilbert curve first conceptualised by David Hilbert is a curve in which a 1 dimensional curve can occupy a
@@ -23,164 +102,203 @@ class HilbertCurve:
     an n order Pseudo Hilbert Curve. The total number of points mapped is equal to N^2 ; N = 2^n.
     """
 
+    base = 2
+
     def __init__(self, order=3):
 
+        self.order = order
         self.N = 2**order
-        self.points = [(0, 0)]
-
-        for i in range(self.N * self.N):
-            self.points.append(self._hilbert_curve_x2xy(i))
-
-    @staticmethod
-    def _bit_mask(x):
-        """
-        Static method used to bit mask the final least significant bits.
-
-        :param x: The input bit string
-
-        :return: The masked bit string
-        """
-        return x & 3
 
-    def _hilbert_curve_x2xy(self, index):
+    @property
+    def points(self):
         """
-        Method for iteratively generating a coordinates of a Pseudo Hilbert Curve. Takes a 1 dimensional index and
-        maps it to a 2 dimensional set of coordinates.
-
-        :param index: The indexed position in 1 dimensional space ranging from 0 to N^2
-
-        :return: a tuple containing the x, y coordinates in 2 dimensional space.
+        The coordinates of the curve, only built when first asked for as dithering can walk the curve without them.
         """
+        return _hilbert_points(self.order)
 
-        # initial starting coordinated of order 1 Hilbert curve
-        positions = (0, 0), (0, 1), (1, 1), (1, 0)
 
-        # gets initial position by masking index then bit shifts index
-        tmp = positions[self._bit_mask(index)]
-        index = index >> 2
+class PeanoCurve:
+    """
+    The Peano curve, the first space filling curve described, fills a square plane that is divided into 3 x 3
+    sub-planes and walked in a serpentine, up the first column, down the second and up the third. Each sub-plane is
+    then divided again and filled with a copy of the curve, mirrored where needed so the copies join up.
 
-        x, y = tmp[0], tmp[1]
+    An n order Pseudo Peano Curve maps N^2 points ; N = 3^n.
+    """
 
-        # loops to determine x, y coordinates based on next bit shifted index.
-        n = 4
-        while n <= self.N:
-            n2 = n // 2
+    base = 3
 
-            i = self._bit_mask(index)
-            if i == 0:
-                x, y = y, x
+    def __init__(self, order=3):
 
-            elif i == 1:
-                x, y = x, y + n2
+        self.order = order
+        self.N = 3**order
+        self.points = self._peano_curve_d2xy(order)
 
-            elif i == 2:
-                x, y = x + n2, y + n2
+    @staticmethod
+    def _peano_curve_d2xy(order):
+        """
+        Static method mapping every 1 dimensional index of a Pseudo Peano Curve to its 2 dimensional coordinates at
+        once. The base 3 digits of an index alternate between x and y from the most significant. A digit is mirrored
+        (d -> 2 - d) when the digits of the other axis read before it add up to an odd number.
 
-            elif i == 3:
-                x, y = (2 * n2 - 1) - y, (n2 - 1) - x
+        :param order: The order of the curve.
 
-            index = index >> 2
-            n *= 2
+        :return: an array of shape (N^2, 2) containing the x, y coordinates in 2 dimensional space.
+        """
+        index = np.arange(9**order, dtype=np.int64)
 
-        return x, y
+        x = np.zeros(index.size, dtype=np.int32)
+        y = np.zeros(index.size, dtype=np.int32)
+        x_sum = np.zeros(index.size, dtype=np.int64)
+        y_sum = np.zeros(index.size, dtype=np.int64)
 
+        for level in range(order - 1, -1, -1):
+            x_digit = index // 9**level // 3 % 3
+            y_digit = index // 9**level % 3
 
-class PeanoCurve:
+            x = 3 * x + np.where(y_sum % 2 == 1, 2 - x_digit, x_digit)
+            x_sum += x_digit
 
-    def __init__(self, order=3):
-        self.N = 9**order
-        self.points = [(0, 0)]
-        self._generate_peano_curve(0)
+            y = 3 * y + np.where(x_sum % 2 == 1, 2 - y_digit, y_digit)
+            y_sum += y_digit
 
-    @staticmethod
-    def _up(x, y):
-        return x, y+1
+        return np.stack([x, y], axis=1)
 
-    @staticmethod
-    def _down(x, y):
-        return x, y-1
 
-    @staticmethod
-    def _left(x, y):
-        return x-1, y
+@njit(cache=True, fastmath=True)
+def _dither_nb(flat_image, indices):
+    """
+    Compiled error diffusion loop of Dithering.dithering. Visits the pixels of the flattened image in the order
+    given by indices, rounding each to 0 or 1 and carrying the error on to the next.
+    """
+    e = 0.0
+    for k in range(indices.size):
+        i = flat_image[indices[k]]
+        o = 0.0 if i + e <= 0.5 else 1.0
+        e += i - o
+        flat_image[indices[k]] = o
 
-    @staticmethod
-    def _right(x, y):
-        return x+1, y
 
-    def _generate_peano_curve(self, index):
+@njit(cache=True, fastmath=True)
+def _hilbert_dither_nb(flat_image, width, order):
+    """
+    Compiled error diffusion loop along a Pseudo Hilbert Curve, walking the curve one step at a time as it goes
+    rather than reading its points.
 
-        coords = self.points[index]
+    Stepping from index d to d + 1 carries past the j lowest base 4 digits of d that equal 3, so the step is the
+    move between quadrants q and q + 1 of level j; up, right or down for q = 0, 1, 2. That move is transposed for
+    each 0 digit above level j and flipped for each 3 digit, only the parity of either count matters so both are
+    kept up to date as the digits change.
+    """
+    digits = np.zeros(order, dtype=np.int64)
+    zeros, threes = order & 1, 0
 
-        i0 = 0
-        i1 = 0
-        for index in range(self.N):
+    x = y = 0
+    e = 0.0
+    last = (1 << 2 * order) - 1
 
-            if index == 30:
-                return
+    for d in range(last + 1):
+        k = y * width + x
+        i = flat_image[k]
+        o = 0.0 if i + e <= 0.5 else 1.0
+        e += i - o
+        flat_image[k] = o
 
-            index %= 9
-            print(index)
+        if d == last:
+            break
 
-            if index == 0 or index == 1 or index == 6 or index == 7:
-                if i1 % 2 == 0:
-                    coords = self._up(*coords)
-                    print("up")
-                else:
-                    coords = self._down(*coords)
-                    print("down")
-            elif index == 2 or index == 5:
-                if i0 % 2 == 0:
-                    coords = self._right(*coords)
-                    print("right")
-                else:
-                    coords = self._left(*coords)
-            elif index == 3 or index == 4:
-                coords = self._down(*coords)
-                print("down")
+        j = 0
+        while digits[j] == 3:
+            j += 1
+        q = digits[j]
 
+        # parities of the digits above level j, those below it are all 3
+        transpose = zeros ^ (q == 0)
+        flip = threes ^ (j & 1)
 
+        if q == 0:
+            dx, dy = 0, 1
+        elif q == 1:
+            dx, dy = 1, 0
+        else:
+            dx, dy = 0, -1
 
-            elif index == 8:
-                i0 += 1
-                if i0 % 3 == 0:
-                    i1 += 1
-                    coords = self._right(*coords)
-                else:
-                    coords = self._up(*coords)
+        if transpose:
+            dx, dy = dy, dx
+        if flip:
+            dx, dy = -dy, -dx
 
-            self.points.append(coords)
+        x += dx
+        y += dy
 
+        # the digits below level j roll over from 3 to 0 and digit j moves on to the next quadrant
+        digits[:j] = 0
+        zeros ^= (j & 1) ^ (q == 0)
+        threes ^= (j & 1) ^ (q == 2)
+        digits[j] = q + 1
 
 
+if not _HAVE_NUMBA:
+    try:
+        from chaos_game_impl import dither as _dither_nb, hilbert_dither as _hilbert_dither_nb
+    except ImportError:
+        pass
 
 
 class Dithering:
 
     def __init__(self, image, Curve):
 
-        log2 = __import__("math").log2
-        order = int(log2(image.shape[0]))
+        # the highest order curve whose side fits within the height of the image, a curve class without a base is
+        # taken to double its side with each order
+        base = getattr(Curve, "base", 2)
+        order = 0
+        while base ** (order + 1) <= image.shape[0]:
+            order += 1
 
         self.curve = Curve(order)
-        self.dithering(image)
+
+        if isinstance(self.curve, HilbertCurve):
+            # the Hilbert curve can be walked while dithering, so its points are never built
+            self._hilbert_dithering(image)
+        else:
+            self.dithering(image)
 
     def dithering(self, image):
 
-        hilbert_points = self.curve.points
+        points = np.asarray(self.curve.points)
 
-        x_0, y_0 = hilbert_points[0]
-        i_0 = image[y_0, x_0]
-        o_0 = 0 if i_0 <= 0.5 else 1
-        e = i_0 - o_0
+        # the kernel writes through the flat indices unchecked, so every point must land inside the image
+        xs, ys = points[:, 0], points[:, 1]
+        if np.any((xs < 0) | (xs >= image.shape[1]) | (ys < 0) | (ys >= image.shape[0])):
+            raise ValueError("{} does not fit inside an image of shape {}".format(
+                type(self.curve).__name__, image.shape))
 
-        image[y_0, x_0] = o_0
+        indices = ys.astype(np.int64) * image.shape[1] + xs
+
+        self._dither_flat(image, _dither_nb, indices)
+
+    def _hilbert_dithering(self, image):
+
+        # the walk covers the top left N x N pixels unchecked, the order is taken from the height so only the width
+        # can fall short
+        if image.shape[1] < self.curve.N:
+            raise ValueError("{} does not fit inside an image of shape {}".format(
+                type(self.curve).__name__, image.shape))
+
+        self._dither_flat(image, _hilbert_dither_nb, image.shape[1], self.curve.order)
+
+    @staticmethod
+    def _dither_flat(image, kernel, *args):
+        """
+        Runs one of the dithering kernels over the flattened image, making sure the result ends up in the image.
+        """
+        flat_image = image.ravel()
+        kernel(flat_image, *args)
 
-        for x, y in hilbert_points[1:]:
-            i = image[y, x]
-            o = 0 if i + e <= 0.5 else 1
-            e += i - o
-            image[y, x] = o
+        # ravel copies rather than views an image that is not contiguous, e.g. one channel of a colour image
+        if not np.shares_memory(flat_image, image):
+            image[...] = flat_image.reshape(image.shape)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,185 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""
+Cython builds of the ChaosGame and Dithering kernels, used in place of the Numba kernels where Numba is not installed.
+Each function matches the kernel of the same name in ChaosGame.py or SpaceFillingCurves.py, the chunks of a game are
+played one after the other rather than in parallel.
+
+Build in place with: python setup.py build_ext --inplace
+"""
+from libc.stdint cimport int64_t, uint8_t, uint16_t, uint32_t
+from libc.string cimport memset
+
+ctypedef fused vertex_t:
+    uint8_t
+    uint16_t
+    uint32_t
+
+ctypedef fused pixel_t:
+    float
+    double
+
+
+def r0_play(const float[:, ::1] vertices, float ratio, const float[::1] draws, Py_ssize_t shape,
+            const float[:, ::1] starts, Py_ssize_t burn_in, float[::1] xs, float[::1] ys):
+
+    cdef Py_ssize_t chunks = starts.shape[0], n = xs.shape[0]
+    cdef Py_ssize_t c, k, lo, hi, random_index
+    cdef float x, y
+    cdef double draw
+
+    with nogil:
+        for c in range(chunks):
+            x, y = starts[c, 0], starts[c, 1]
+
+            lo, hi = c * n // chunks, (c + 1) * n // chunks
+
+            for k in range(lo - burn_in, hi):
+
+                draw = draws[k + (c + 1) * burn_in]
+
+                random_index = <Py_ssize_t>(draw * shape)
+
+                x = (x + vertices[random_index, 0]) * ratio
+                y = (y + vertices[random_index, 1]) * ratio
+
+                if k >= lo:
+                    xs[k] = x
+                    ys[k] = y
+
+
+def r2_play(const float[:, ::1] vertices, float ratio, const float[::1] draws, Py_ssize_t shape,
+            const vertex_t[::1] neighbours, const float[:, ::1] starts, Py_ssize_t burn_in,
+            float[::1] xs, float[::1] ys):
+
+    cdef Py_ssize_t chunks = starts.shape[0], n = xs.shape[0]
+    cdef Py_ssize_t c, k, lo, hi, random_index, forbidden
+    cdef float x, y
+    cdef double draw
+
+    with nogil:
+        for c in range(chunks):
+            x, y = starts[c, 0], starts[c, 1]
+
+            # no vertex is excluded until one has been chosen
+            forbidden = shape
+
+            lo, hi = c * n // chunks, (c + 1) * n // chunks
+
+            for k in range(lo - burn_in, hi):
+
+                draw = draws[k + (c + 1) * burn_in]
+
+                # draw from the vertices that remain and step over the excluded one
+                random_index = <Py_ssize_t>(draw * (shape - (forbidden < shape)))
+                random_index += random_index >= forbidden
+
+                x = (x + vertices[random_index, 0]) * ratio
+                y = (y + vertices[random_index, 1]) * ratio
+                forbidden = neighbours[random_index]
+
+                if k >= lo:
+                    xs[k] = x
+                    ys[k] = y
+
+
+def r4_play(const float[:, ::1] vertices, float ratio, const float[::1] draws, Py_ssize_t shape,
+            const vertex_t[:, ::1] allowed, const float[:, ::1] starts, Py_ssize_t burn_in,
+            float[::1] xs, float[::1] ys):
+
+    cdef Py_ssize_t chunks = starts.shape[0], n = xs.shape[0], width = allowed.shape[1]
+    cdef Py_ssize_t c, k, lo, hi, random_index, prev_0, prev_1
+    cdef float x, y
+    cdef double draw
+
+    with nogil:
+        for c in range(chunks):
+            x, y = starts[c, 0], starts[c, 1]
+            prev_0, prev_1 = -2, -1
+
+            lo, hi = c * n // chunks, (c + 1) * n // chunks
+
+            for k in range(lo - burn_in, hi):
+
+                draw = draws[k + (c + 1) * burn_in]
+
+                if prev_0 == prev_1:
+                    random_index = allowed[prev_1, <Py_ssize_t>(draw * width)]
+                else:
+                    random_index = <Py_ssize_t>(draw * shape)
+
+                x = (x + vertices[random_index, 0]) * ratio
+                y = (y + vertices[random_index, 1]) * ratio
+                prev_0, prev_1 = prev_1, random_index
+
+                if k >= lo:
+                    xs[k] = x
+                    ys[k] = y
+
+
+def dither(pixel_t[::1] flat_image, const int64_t[::1] indices):
+
+    cdef Py_ssize_t k
+    cdef double i, o, e = 0.0
+
+    with nogil:
+        for k in range(indices.shape[0]):
+            i = flat_image[indices[k]]
+            o = 0.0 if i + e <= 0.5 else 1.0
+            e += i - o
+            flat_image[indices[k]] = o
+
+
+def hilbert_dither(pixel_t[::1] flat_image, Py_ssize_t width, int order):
+
+    cdef uint8_t digits[32]
+    cdef int j, q, transpose, flip, zeros = order & 1, threes = 0
+    cdef Py_ssize_t x = 0, y = 0, dx, dy, k
+    cdef int64_t d, last
+    cdef double i, o, e = 0.0
+
+    if not 0 <= order <= 31:
+        raise ValueError("order must be between 0 and 31")
+
+    memset(digits, 0, sizeof(digits))
+    last = (<int64_t>1 << 2 * order) - 1
+
+    with nogil:
+        for d in range(last + 1):
+            k = y * width + x
+            i = flat_image[k]
+            o = 0.0 if i + e <= 0.5 else 1.0
+            e += i - o
+            flat_image[k] = o
+
+            if d == last:
+                break
+
+            j = 0
+            while digits[j] == 3:
+                j += 1
+            q = digits[j]
+
+            # parities of the digits above level j, those below it are all 3
+            transpose = zeros ^ (q == 0)
+            flip = threes ^ (j & 1)
+
+            if q == 0:
+                dx, dy = 0, 1
+            elif q == 1:
+                dx, dy = 1, 0
+            else:
+                dx, dy = 0, -1
+
+            if transpose:
+                dx, dy = dy, dx
+            if flip:
+                dx, dy = -dy, -dx
+
+            x += dx
+            y += dy
+
+            # the digits below level j roll over from 3 to 0 and digit j moves on to the next quadrant
+            memset(digits, 0, j)
+            zeros ^= (j & 1) ^ (q == 0)
+            threes ^= (j & 1) ^ (q == 2)
+            digits[j] = q + 1
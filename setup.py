@@ -0,0 +1,16 @@
+"""
+Builds the optional Cython kernels in chaos_game_impl.pyx, used by ChaosGame and Dithering when Numba is not installed,
+and packages them with the two modules.
+
+    python setup.py build_ext --inplace
+    python -m pip wheel .
+"""
+from Cython.Build import cythonize
+from setuptools import Extension, setup
+
+setup(
+    name="chaos",
+    py_modules=["ChaosGame", "SpaceFillingCurves"],
+    install_requires=["numpy"],
+    ext_modules=cythonize([Extension("chaos_game_impl", ["chaos_game_impl.pyx"])]),
+)